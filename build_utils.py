@@ -4,11 +4,21 @@
 """
 
 import os
+import re
+import json
 import sys
+import shlex
+import signal
 import subprocess
 import shutil
+import hashlib
+import importlib.util
+import threading
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Union
 
 
 class BuildError(Exception):
@@ -16,17 +26,203 @@ class BuildError(Exception):
     pass
 
 
+# 进程级不变量，导入时计算一次
+_PROJECT_ROOT = Path(".")
+_BUILDOZER_SDK = Path.home() / ".buildozer" / "android" / "platform" / "android-sdk"
+_SDK_CACHE_FILE = Path.home() / ".cache" / "changtian-build" / "sdk.json"
+_MB = 1 << 20
+
+# 构建APK时需要可执行权限的构建工具
+_EXECUTABLE_BUILD_TOOLS = frozenset({"aidl", "aapt", "aapt2", "zipalign", "dx", "d8"})
+
+# 构建日志关键词，编译为单个字节正则：每行只扫描一次，且无需先解码
+_LOG_KEY_PHRASES = (
+    "sdkmanager",
+    "aidl",
+    "error",
+    "failed",
+    "exception",
+    "not found",
+    "no such file",
+    "cannot find"
+)
+_LOG_PAT = re.compile(
+    b"|".join(re.escape(phrase.encode()) for phrase in _LOG_KEY_PHRASES),
+    re.IGNORECASE
+)
+
+# 错误/失败行按整词匹配，"ErrorProne"、"failedTests"等标识符片段不计入
+_ERR_RE = re.compile(rb'\b(?:error|failed)\b', re.IGNORECASE)
+_ERR_WORDS = frozenset({b"error", b"failed"})
+
+# buildozer.spec中必须存在的配置项，单次正则扫描；按行首锚定，注释行不会误匹配
+_SPEC_REQUIRED_KEYS = frozenset({"android.archs", "android.api", "requirements"})
+# 与buildozer使用的ConfigParser一致，键值分隔符可以是"="或":"；只在[app]节内查找
+_SPEC_RE = re.compile(rb'^(android\.archs|android\.api|requirements)[ \t]*[=:]', re.M)
+_SPEC_SECTION_RE = re.compile(rb'^\[([^\]\r\n]+)\]', re.M)
+
+# 不可能包含APK的目录，遍历时直接剪枝（p4a中间产物目录other_builds、objects_*同样跳过）
+_APK_SKIP_DIRS = frozenset({".git", ".gradle", "__pycache__", "_python_bundle", "other_builds"})
+_APK_SKIP_PREFIXES = ("objects_",)
+
+
+def _spec_section(data: bytes, name: bytes) -> bytes:
+    """返回spec内容中指定节的正文（节头之后到下一个节头之前），不存在时返回空"""
+    sections = list(_SPEC_SECTION_RE.finditer(data))
+    for i, match in enumerate(sections):
+        if match.group(1).strip() == name:
+            end = sections[i + 1].start() if i + 1 < len(sections) else len(data)
+            return data[match.end():end]
+    return b""
+
+
+def _find_apks(root: Path, recursive: bool = True) -> List[Tuple[Path, os.stat_result]]:
+    """查找root下的APK文件，返回(路径, stat结果)
+    
+    每个目录仅一次readdir；目录判断使用DirEntry缓存的类型，不额外stat，
+    只对命中的APK调用一次DirEntry.stat()，供调用方复用文件大小。
+    """
+    apks = []
+    pending = deque([str(root)])
+    while pending:
+        directory = pending.popleft()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if (recursive and entry.name not in _APK_SKIP_DIRS
+                            and not entry.name.startswith(_APK_SKIP_PREFIXES)):
+                        pending.append(entry.path)
+                elif entry.name.endswith(".apk"):
+                    try:
+                        apks.append((Path(entry.path), entry.stat()))
+                    except OSError:
+                        continue
+    # readdir顺序依赖文件系统，排序以保证输出稳定
+    return sorted(apks, key=lambda item: item[0])
+
+
+def _find_dists_dirs(project_root: Path) -> List[Path]:
+    """buildozer的dists目录：旧版为platform/build/dists，
+    1.3起按架构分目录（如platform/build-armeabi-v7a/dists），一次readdir全部列出"""
+    platform_dir = project_root / ".buildozer" / "android" / "platform"
+    try:
+        with os.scandir(platform_dir) as entries:
+            dists_dirs = [
+                Path(entry.path) / "dists" for entry in entries
+                if entry.is_dir() and (entry.name == "build" or entry.name.startswith("build-"))
+            ]
+    except OSError:
+        return []
+    return sorted(dists_dirs)
+
+
+def _dedupe_search_roots(locations: List[Tuple[Path, bool]]) -> List[Tuple[Path, bool]]:
+    """按真实路径去除重复的查找位置，以及已被前面递归查找覆盖的子目录"""
+    roots = []
+    seen: List[Tuple[Path, bool]] = []
+    for location, recursive in locations:
+        resolved = location.resolve()
+        if any(resolved == root or (root_recursive and resolved.is_relative_to(root))
+               for root, root_recursive in seen):
+            continue
+        seen.append((resolved, recursive))
+        roots.append((location, recursive))
+    return roots
+
+
+def _limited_tree(root: Path, suffixes: Tuple[str, ...] = (".apk", ".log"),
+                  max_entries: int = 500, max_depth: int = 12) -> Tuple[List[Path], bool]:
+    """广度优先列出root下指定后缀的文件，限制数量和深度，返回(结果, 是否截断)
+    
+    dists下的APK位于build-<archs>/dists/<app>/build/outputs/apk/<type>/，
+    深度需足够到达；与_find_apks一样跳过中间产物目录。
+    """
+    collected = []
+    pending = deque([(str(root), 0)])
+    while pending:
+        directory, depth = pending.popleft()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if (depth + 1 < max_depth and entry.name not in _APK_SKIP_DIRS
+                            and not entry.name.startswith(_APK_SKIP_PREFIXES)):
+                        pending.append((entry.path, depth + 1))
+                elif entry.name.endswith(suffixes):
+                    collected.append(Path(entry.path))
+                    if len(collected) >= max_entries:
+                        return collected, True
+    return collected, False
+
+
+def _version_key(path: Path) -> Tuple:
+    """将构建工具目录名解析为可排序的版本键
+
+    只解析开头的点分数字部分，带后缀的预发布版本排在同号正式版之前，
+    如 "34.0.0-rc1" < "34.0.0"
+    """
+    match = re.match(r'(\d+(?:\.\d+)*)(.*)', path.name)
+    if not match:
+        return ((), 0, ())
+    numbers = tuple(int(part) for part in match.group(1).split('.'))
+    suffix = match.group(2)
+    if not suffix:
+        return (numbers, 1, ())
+    return (numbers, 0, tuple(int(part) for part in re.findall(r'\d+', suffix)))
+
+
 class BuildUtils:
     """构建工具类"""
     
     def __init__(self):
-        self.project_root = Path(".")
-        self.buildozer_sdk_dir = Path.home() / ".buildozer" / "android" / "platform" / "android-sdk"
+        self.project_root = _PROJECT_ROOT
+        self.buildozer_sdk_dir = _BUILDOZER_SDK
+        self.sdkmanager_path = self.buildozer_sdk_dir / "tools" / "bin" / "sdkmanager"
+        self.sdk_cache_file = _SDK_CACHE_FILE
+        self._buildozer = None
+    
+    @functools.cached_property
+    def build_tools_dirs(self) -> List[Path]:
+        """SDK中已安装的构建工具目录，按版本号升序（每个进程仅扫描一次）"""
+        try:
+            with os.scandir(self.buildozer_sdk_dir / "build-tools") as entries:
+                dirs = [Path(entry.path) for entry in entries if entry.is_dir()]
+        except OSError:
+            return []
+        # 按版本号排序（"34.0.0" 排在 "30.0.3" 之后），结果与readdir顺序无关
+        return sorted(dirs, key=lambda p: (_version_key(p), p.name))
+    
+    @functools.cached_property
+    def aidl_path(self) -> Optional[Path]:
+        """最新版本构建工具中的aidl路径
+        
+        aidl只随build-tools分发，因此只检查各构建工具目录，不遍历整个SDK；
+        从最新版本开始查找，找到即停止。
+        """
+        for tool_dir in reversed(self.build_tools_dirs):
+            aidl_path = os.path.join(tool_dir, "aidl")
+            if os.path.isfile(aidl_path):
+                return Path(aidl_path)
+        return None
         
     def verify_sdk_installation(self):
         """验证SDK安装"""
         print("=== 验证Android SDK安装 ===")
         
+        # SDK未发生变化时直接使用上次的验证结果
+        cached = self._load_sdk_cache()
+        if cached is not None:
+            print(f"Android SDK路径: {self.buildozer_sdk_dir}")
+            print(f"✓ 使用缓存的SDK验证结果，AIDL工具: {cached['aidl_path']}")
+            return True
+        
         # 检查SDK目录是否存在
         if not self.buildozer_sdk_dir.exists():
             raise BuildError(f"Android SDK目录不存在: {self.buildozer_sdk_dir}")
@@ -34,7 +230,7 @@ class BuildUtils:
         print(f"Android SDK路径: {self.buildozer_sdk_dir}")
         
         # 检查sdkmanager在期望位置
-        sdkmanager_path = self.buildozer_sdk_dir / "tools" / "bin" / "sdkmanager"
+        sdkmanager_path = self.sdkmanager_path
         if not sdkmanager_path.exists():
             raise BuildError(f"sdkmanager未在期望位置找到: {sdkmanager_path}")
         
@@ -48,7 +244,7 @@ class BuildUtils:
             print(f"⚠ 无法设置sdkmanager可执行: {e}")
         
         # 检查构建工具
-        build_tools_dirs = list(self.buildozer_sdk_dir.glob("build-tools/*"))
+        build_tools_dirs = self.build_tools_dirs
         if not build_tools_dirs:
             raise BuildError("未找到Android构建工具")
         else:
@@ -57,24 +253,84 @@ class BuildUtils:
                 print(f"  - {tool_dir.name}")
         
         # 检查AIDL工具
-        aidl_found = False
-        for tool_dir in build_tools_dirs:
-            aidl_path = tool_dir / "aidl"
-            if aidl_path.exists():
-                print(f"✓ 找到AIDL工具: {aidl_path}")
-                aidl_found = True
-                try:
-                    aidl_path.chmod(0o755)
-                    print("✓ AIDL工具设置为可执行")
-                except Exception as e:
-                    print(f"⚠ 无法设置AIDL可执行: {e}")
-                break
-        
-        if not aidl_found:
+        aidl_path = self.aidl_path
+        if aidl_path is None:
             raise BuildError("AIDL工具未找到")
         
+        print(f"✓ 找到AIDL工具: {aidl_path}")
+        self._make_build_tools_executable(aidl_path.parent)
+        
+        self._save_sdk_cache(sdkmanager_path, aidl_path)
         return True
     
+    def _make_build_tools_executable(self, tool_dir: Path):
+        """单次扫描构建工具目录，将构建APK用到的工具设置为可执行"""
+        made_executable = []
+        try:
+            with os.scandir(tool_dir) as entries:
+                for entry in entries:
+                    if entry.name not in _EXECUTABLE_BUILD_TOOLS:
+                        continue
+                    try:
+                        os.chmod(entry.path, 0o755)
+                        made_executable.append(entry.name)
+                    except OSError as e:
+                        print(f"⚠ 无法设置{entry.name}可执行: {e}")
+        except OSError as e:
+            print(f"⚠ 无法读取构建工具目录: {e}")
+            return
+        if made_executable:
+            print(f"✓ 构建工具设置为可执行: {', '.join(sorted(made_executable))}")
+    
+    def _sdk_cache_key(self) -> Optional[List]:
+        """SDK缓存键：SDK路径及SDK根目录、build-tools目录的修改时间"""
+        try:
+            return [
+                str(self.buildozer_sdk_dir),
+                self.buildozer_sdk_dir.stat().st_mtime_ns,
+                (self.buildozer_sdk_dir / "build-tools").stat().st_mtime_ns
+            ]
+        except OSError:
+            return None
+    
+    def _load_sdk_cache(self) -> Optional[Dict]:
+        """读取SDK验证缓存，缓存失效或被禁用（CHANGTIAN_NO_SDK_CACHE=1）时返回None"""
+        if os.environ.get('CHANGTIAN_NO_SDK_CACHE') == '1':
+            return None
+        key = self._sdk_cache_key()
+        if key is None:
+            return None
+        try:
+            with open(self.sdk_cache_file, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(record, dict) or record.get('key') != key:
+            return None
+        if not all(os.path.isfile(record.get(name, '')) for name in ('sdkmanager_path', 'aidl_path')):
+            return None
+        return record
+    
+    def _save_sdk_cache(self, sdkmanager_path: Path, aidl_path: Path):
+        """写入SDK验证缓存"""
+        if os.environ.get('CHANGTIAN_NO_SDK_CACHE') == '1':
+            return
+        key = self._sdk_cache_key()
+        if key is None:
+            return
+        record = {
+            "key": key,
+            "sdkmanager_path": str(sdkmanager_path),
+            "aidl_path": str(aidl_path),
+            "build_tools_dirs": [str(p) for p in self.build_tools_dirs]
+        }
+        try:
+            self.sdk_cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.sdk_cache_file, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"⚠ 无法写入SDK验证缓存: {e}")
+    
     def setup_environment(self):
         """设置构建环境"""
         print("=== 设置构建环境 ===")
@@ -83,6 +339,15 @@ class BuildUtils:
             # 确保必要的目录存在
             (self.project_root / "bin").mkdir(exist_ok=True)
             
+            # 检查buildozer是否已安装（仅查找模块或可执行文件，不启动buildozer进程）；
+            # 通过pipx或其他虚拟环境安装、只在PATH中可用的buildozer由子进程调用
+            if importlib.util.find_spec("buildozer") is None and shutil.which("buildozer") is None:
+                raise BuildError("Buildozer未正确安装")
+            print("✓ Buildozer验证通过")
+            
+            # 检查buildozer.spec配置
+            self._validate_buildozer_config()
+            
             # 验证SDK安装
             self.verify_sdk_installation()
             
@@ -91,66 +356,138 @@ class BuildUtils:
         except Exception as e:
             raise BuildError(f"环境设置失败: {e}")
     
+    def _validate_buildozer_config(self):
+        """检查buildozer.spec是否包含必要的配置项"""
+        spec_file = self.project_root / "buildozer.spec"
+        try:
+            data = spec_file.read_bytes()
+        except OSError:
+            raise BuildError(f"buildozer.spec不存在: {spec_file}")
+        
+        found = {m.group(1).decode() for m in _SPEC_RE.finditer(_spec_section(data, b"app"))}
+        missing = _SPEC_REQUIRED_KEYS - found
+        if missing:
+            raise BuildError(f"buildozer.spec缺少配置项: {', '.join(sorted(missing))}")
+        
+        print("✓ buildozer.spec配置检查通过")
+    
     def run_build(self):
         """执行构建"""
         print("=== 执行APK构建 ===")
         
         try:
-            # 设置环境变量
-            os.environ['ANDROID_HOME'] = str(self.buildozer_sdk_dir)
-            os.environ['ANDROID_SDK_ROOT'] = str(self.buildozer_sdk_dir)
+            # 构建所需的环境变量只传给buildozer，不修改当前进程的os.environ
+            android_env = {
+                'ANDROID_HOME': str(self.buildozer_sdk_dir),
+                'ANDROID_SDK_ROOT': str(self.buildozer_sdk_dir)
+            }
             
-            print(f"环境变量设置: ANDROID_HOME={os.environ.get('ANDROID_HOME')}")
-            print(f"环境变量设置: ANDROID_SDK_ROOT={os.environ.get('ANDROID_SDK_ROOT')}")
+            print(f"环境变量设置: ANDROID_HOME={android_env['ANDROID_HOME']}")
+            print(f"环境变量设置: ANDROID_SDK_ROOT={android_env['ANDROID_SDK_ROOT']}")
             
-            # 清理之前的构建
-            print("清理构建环境...")
-            self._run_command("buildozer android clean", check=False)
+            # 清理之前的构建（构建配置未变化且已有发行包时跳过，FORCE_CLEAN=1强制清理）
+            spec_hash = self._spec_fingerprint()
+            spec_stamp = self._read_stamp(self.project_root / ".buildozer" / ".spec_hash")
+            has_dists = any(dists_dir.is_dir() for dists_dir in _find_dists_dirs(self.project_root))
+            if (os.environ.get('FORCE_CLEAN') != '1' and spec_hash is not None
+                    and spec_hash == spec_stamp and has_dists):
+                print("构建配置未变化，跳过清理")
+            else:
+                print("清理构建环境...")
+                self._run_buildozer(["android", "clean"], capture=False, env=android_env, in_process=True)
             
             # 执行构建
             print("开始构建APK...")
-            result = self._run_command(
-                "buildozer -v android debug", 
-                check=False,
-                capture=False
-            )
+            returncode = self._run_buildozer(["-v", "android", "debug"], capture=False, env=android_env)
             
-            if result.returncode == 0:
+            if returncode == 0:
                 print("✓ 构建成功完成")
+                if spec_hash is not None:
+                    self._write_spec_stamp(spec_hash)
                 return True
             else:
-                print(f"✗ 构建失败，退出码: {result.returncode}")
+                print(f"✗ 构建失败，退出码: {returncode}")
                 return False
                 
         except Exception as e:
             print(f"✗ 构建过程出错: {e}")
             return False
     
+    def _spec_fingerprint(self) -> Optional[str]:
+        """计算构建配置（buildozer.spec与requirements.txt）的内容哈希"""
+        digest = hashlib.blake2b()
+        try:
+            with open(self.project_root / "buildozer.spec", 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            return None
+        try:
+            with open(self.project_root / "requirements.txt", 'rb') as f:
+                digest.update(b"\0" + f.read())
+        except OSError:
+            pass
+        return digest.hexdigest()
+    
+    def _read_stamp(self, stamp: Path) -> Optional[str]:
+        """读取标记文件内容，不存在时返回None"""
+        try:
+            return stamp.read_text().strip()
+        except OSError:
+            return None
+    
+    def _write_spec_stamp(self, spec_hash: str):
+        """记录本次成功构建所用的构建配置哈希"""
+        stamp = self.project_root / ".buildozer" / ".spec_hash"
+        try:
+            stamp.parent.mkdir(exist_ok=True)
+            stamp.write_text(spec_hash)
+        except OSError as e:
+            print(f"⚠ 无法写入构建配置哈希: {e}")
+    
     def check_build_result(self):
         """检查构建结果"""
         try:
             print("=== 检查构建结果 ===")
             
-            # 在多个可能的位置查找APK
-            apk_locations = [
-                self.project_root / "bin",
-                self.project_root / ".buildozer" / "android" / "platform" / "build" / "dists",
-                self.project_root
-            ]
+            # bin为最终输出目录，先单独查找，找到即停止；
+            # 仅当bin中没有APK时才遍历各dists目录，项目根目录只检查直接子项
+            bin_dir = self.project_root / "bin"
+            # 与bin重复（如符号链接指向同一目录）的位置不再查找
+            fallback_locations = _dedupe_search_roots([
+                (bin_dir, True),
+                *((dists_dir, True) for dists_dir in _find_dists_dirs(self.project_root)),
+                (self.project_root, False)
+            ])[1:]
             
-            apk_files = []
-            for location in apk_locations:
-                if location.exists():
-                    found = list(location.glob("**/*.apk"))
-                    apk_files.extend(found)
-                    if found:
-                        print(f"在 {location} 找到 {len(found)} 个APK文件")
+            # 以解析后的真实路径去重
+            apk_files: Dict[Path, Tuple[Path, os.stat_result]] = {}
+            
+            def collect(location: Path, found_apks: List[Tuple[Path, os.stat_result]]) -> int:
+                found = 0
+                for apk, apk_stat in found_apks:
+                    resolved = apk.resolve()
+                    if resolved not in apk_files:
+                        apk_files[resolved] = (apk, apk_stat)
+                        found += 1
+                if found:
+                    print(f"在 {location} 找到 {found} 个APK文件")
+                return found
+            
+            if not collect(bin_dir, _find_apks(bin_dir)) and fallback_locations:
+                # 其余位置并发遍历（I/O密集，readdir/stat期间释放GIL），结果仍按优先级合并；
+                # 不存在的目录由_find_apks直接跳过，无需预先stat
+                with ThreadPoolExecutor(max_workers=len(fallback_locations)) as pool:
+                    results = pool.map(lambda loc: _find_apks(*loc), fallback_locations)
+                    for (location, _), found_apks in zip(fallback_locations, results):
+                        collect(location, found_apks)
             
             if not apk_files:
+                self._print_buildozer_tree()
                 raise BuildError("未找到APK文件")
             
-            for apk in apk_files:
-                size_mb = apk.stat().st_size / (1024 * 1024)
+            # 复用遍历时得到的stat结果，不再重复stat
+            for apk, apk_stat in apk_files.values():
+                size_mb = apk_stat.st_size / _MB
                 print(f"✓ 找到APK: {apk.relative_to(self.project_root)} ({size_mb:.1f} MB)")
             
             print("✓ 构建成功!")
@@ -163,53 +500,169 @@ class BuildUtils:
             self._analyze_build_log()
             return False
     
+    def _print_buildozer_tree(self):
+        """列出.buildozer中的APK和日志文件，辅助定位构建失败原因"""
+        buildozer_dir = self.project_root / ".buildozer"
+        files, truncated = _limited_tree(buildozer_dir)
+        if not files:
+            return
+        print("Buildozer目录结构:")
+        for path in files:
+            print(f"  {path.relative_to(self.project_root)}")
+        if truncated:
+            print("  … (已截断)")
+    
     def _analyze_build_log(self):
         """分析构建日志"""
         build_log = self.project_root / "build.log"
         if build_log.exists():
             print("=== 构建日志分析 ===")
             
-            with open(build_log, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                
-                # 查找关键错误
-                key_phrases = [
-                    "sdkmanager",
-                    "aidl",
-                    "error",
-                    "failed", 
-                    "not found",
-                    "no such file"
-                ]
-                
-                for phrase in key_phrases:
-                    if phrase in content.lower():
-                        print(f"发现 '{phrase}' 相关错误:")
-                        lines = [line for line in content.split('\n') if phrase in line.lower()]
-                        for line in lines[:5]:
-                            print(f"  {line}")
+            # 单次流式扫描，每类关键词仅保留最后5行，另保留最后10条错误/失败行
+            # 和日志最后30行；以字节读取，只解码命中的行
+            matches = {phrase: deque(maxlen=5) for phrase in _LOG_KEY_PHRASES}
+            error_lines = deque(maxlen=10)
+            tail = deque(maxlen=30)
+            
+            with open(build_log, 'rb') as f:
+                for line in f:
+                    tail.append(line)
+                    hits = _LOG_PAT.findall(line)
+                    if not hits:
+                        continue
+                    text = line.rstrip(b'\r\n').decode('utf-8', errors='ignore')
+                    # error/failed两类只按整词计入，_LOG_PAT的子串命中在此剔除；
+                    # 二者也在_LOG_PAT中，未命中关键词的行无需再检查
+                    err_hits = _ERR_RE.findall(line)
+                    phrases = {hit.lower() for hit in hits} - _ERR_WORDS
+                    phrases.update(hit.lower() for hit in err_hits)
+                    for phrase in phrases:
+                        matches[phrase.decode()].append(text)
+                    if err_hits:
+                        error_lines.append(text)
+            
+            # 先拼接完整报告，再一次性写出
+            report = []
+            for phrase in _LOG_KEY_PHRASES:
+                if matches[phrase]:
+                    report.append(f"发现 '{phrase}' 相关错误:\n")
+                    report.extend(f"  {line}\n" for line in matches[phrase])
+            
+            if error_lines:
+                report.append(f"最后{len(error_lines)}条错误/失败行:\n")
+                report.extend(f"  {line}\n" for line in error_lines)
+            
+            if tail:
+                report.append(f"构建日志最后{len(tail)}行:\n")
+                texts = (line.rstrip(b'\r\n').decode('utf-8', errors='ignore') for line in tail)
+                report.extend(f"  {text}\n" for text in texts)
+            
+            sys.stdout.write(''.join(report))
+            sys.stdout.flush()
                 
         else:
             print("无构建日志文件")
     
-    def _run_command(self, command: str, check: bool = True, capture: bool = True) -> subprocess.CompletedProcess:
-        """运行命令"""
+    def _run_buildozer(self, args: List[str], capture: bool = True,
+                       env: Optional[Dict[str, str]] = None, in_process: bool = False) -> int:
+        """执行buildozer命令，返回退出码
+        
+        in_process=True且不捕获输出时在当前进程中调用buildozer，省去一次启动和导入开销；
+        进程内调用无法设置超时，也无法截取输出，因此只用于clean等短命令。
+        其余情况（包括长时间的android debug构建）以及buildozer无法导入时，
+        经_run_command在子进程中执行，保留超时、进程组终止和输出尾部截取。
+        env中的变量附加到buildozer启动的子进程环境中。
+        """
+        if in_process and not capture:
+            try:
+                from buildozer import Buildozer
+            except ImportError:
+                pass
+            else:
+                return self._run_buildozer_in_process(Buildozer, args, env)
+        
+        full_env = {**os.environ, **env} if env else None
+        return self._run_command(["buildozer", *args], check=False, capture=capture, env=full_env).returncode
+    
+    def _run_buildozer_in_process(self, buildozer_cls, args: List[str],
+                                  env: Optional[Dict[str, str]] = None) -> int:
+        """在当前进程中执行buildozer命令，多条命令共享同一个Buildozer实例"""
+        print(f"执行命令(进程内): buildozer {shlex.join(args)}")
+        try:
+            if self._buildozer is None:
+                self._buildozer = buildozer_cls()
+            if env:
+                # Buildozer.environ是其启动子进程时使用的环境
+                self._buildozer.environ.update(env)
+            self._buildozer.run_command(list(args))
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            return 1
+        except Exception as e:
+            print(f"错误: {e}")
+            return 1
+        return 0
+    
+    def _run_command(self, command: Union[str, List[str]], check: bool = True, capture: bool = True,
+                     env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+        """运行命令（直接执行argv，不经过shell；字符串命令用shlex拆分）
+        
+        捕获输出的命令以绝对路径可执行文件、close_fds=False、cwd=None调用时，
+        CPython (3.8+, Linux) 使用posix_spawn()而非fork()+exec()创建子进程。
+        不捕获输出的长时间命令在独立会话中运行（因此不走posix_spawn），
+        超时或被中断（Ctrl-C）时终止整个进程组。
+        """
+        argv = shlex.split(command) if isinstance(command, str) else list(command)
+        command = shlex.join(argv)
+        spawn_argv = [shutil.which(argv[0]) or argv[0], *argv[1:]]
+        cwd = None if self.project_root == _PROJECT_ROOT else self.project_root
         try:
             print(f"执行命令: {command}")
             
             if capture:
-                result = subprocess.run(
-                    command, shell=True, capture_output=True, text=True, 
-                    timeout=1800, cwd=self.project_root
-                )
-                if result.stdout:
-                    print(f"输出: {result.stdout[-500:]}")
-                if result.stderr:
-                    print(f"错误: {result.stderr[-500:]}")
+                # 两个线程边读边丢弃，stdout/stderr各只保留最后50行，
+                # 内存占用与输出总量无关；非UTF-8字节替换后保留，读取线程不会因解码失败退出
+                stdout_tail = deque(maxlen=50)
+                stderr_tail = deque(maxlen=50)
+                with subprocess.Popen(
+                    spawn_argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    encoding='utf-8', errors='replace', bufsize=1,
+                    cwd=cwd, env=env, close_fds=False
+                ) as proc:
+                    readers = [
+                        threading.Thread(target=tail.extend, args=(stream,), daemon=True)
+                        for tail, stream in ((stdout_tail, proc.stdout), (stderr_tail, proc.stderr))
+                    ]
+                    for reader in readers:
+                        reader.start()
+                    try:
+                        proc.wait(timeout=1800)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+                        raise
+                    for reader in readers:
+                        reader.join()
+                result = subprocess.CompletedProcess(argv, proc.returncode)
+                if stdout_tail:
+                    print(f"输出: {''.join(stdout_tail)[-1000:]}")
+                if stderr_tail:
+                    print(f"错误: {''.join(stderr_tail)[-1000:]}")
             else:
-                result = subprocess.run(
-                    command, shell=True, timeout=1800, cwd=self.project_root
-                )
+                with subprocess.Popen(
+                    spawn_argv, cwd=cwd, env=env, close_fds=False, start_new_session=True
+                ) as proc:
+                    try:
+                        proc.wait(timeout=1800)
+                    except BaseException:
+                        # 超时或Ctrl-C：子进程在独立会话中收不到SIGINT，
+                        # 需主动连同gradle等子孙进程一起终止
+                        try:
+                            os.killpg(proc.pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                        raise
+                result = subprocess.CompletedProcess(argv, proc.returncode)
             
             if check and result.returncode != 0:
                 raise BuildError(f"命令执行失败: {command} (退出码: {result.returncode})")
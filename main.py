@@ -4,18 +4,33 @@ from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.uix.label import Label
-from kivy.uix.scrollview import ScrollView
-from kivy.uix.popup import Popup
-from kivy.uix.progressbar import ProgressBar
 from kivy.clock import Clock
 import json
 import re
+import hashlib
 import threading
+from collections import Counter, OrderedDict
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时回退到标准库json
+    orjson = None
 
 kivy.require('2.1.0')
 
+# 解析时每处理多少个条目刷新一次状态
+_STATUS_BATCH = 500
+
+# 最近转换结果的缓存条数，重复转换相同输入时直接显示结果
+_RESULT_CACHE_SIZE = 4
+
+# 伪XML条目与字段的正则，模块加载时编译一次；
+# 字段只在所属条目的文本内匹配，未闭合的标签不会越过<endl>
+_ENTRY_RE = re.compile(r'<startl>(.*?)<endl>', re.DOTALL)
+_FIELD_RE = re.compile(r'<(\w+)>(.*?)</\1>', re.DOTALL)
+
 
 class XMLToTavoConverter:
     """将伪XML转换为Tavo格式JSON的转换器"""
@@ -23,39 +38,67 @@ class XMLToTavoConverter:
     @staticmethod
     def parse_xml_content(content: str) -> List[Dict[str, Any]]:
         """解析伪XML内容为结构化数据"""
+        return list(XMLToTavoConverter.iter_entries(content))
+
+    @staticmethod
+    def parse_xml_content_with_stats(
+        content: str,
+        progress: Optional[Callable[[int], None]] = None,
+        cancel_event: Optional[threading.Event] = None
+    ) -> Tuple[List[Dict[str, Any]], Counter]:
+        """解析伪XML内容，同时统计条目类型，避免生成JSON时再遍历一遍
+
+        每解析_STATUS_BATCH个条目调用一次progress(已解析数)；
+        cancel_event被设置时立即停止，返回已解析的部分结果
+        """
         entries = []
-        entry_pattern = r'<startl>(.*?)<endl>'
-        field_pattern = r'<(\w+)>(.*?)</\1>'
-
-        for i, entry_text in enumerate(re.findall(entry_pattern, content, re.DOTALL)):
-            fields = dict(re.findall(field_pattern, entry_text, re.DOTALL))
-
-            entry = {
-                "id": i + 1,
-                "metadata": {
-                    "name": fields.get('comment', '未命名'),
-                    "position": fields.get('position', '未知'),
-                    "type": fields.get('constant', '未知'),
-                    "scan_depth": fields.get('scanDep', ''),
-                    "sticky": fields.get('sticky', ''),
-                    "cooldown": fields.get('cooldown', ''),
-                    "delay": fields.get('delay', '')
-                },
-                "content": {
-                    "keywords": fields.get('keyPositif', ''),
-                    "negative_keywords": fields.get('keyAdverse', ''),
-                    "main_content": fields.get('content', ''),
-                    "annotation": fields.get('CN_annotation', ''),
-                    "development": fields.get('development', '')
-                }
-            }
+        stats = Counter()
+        for entry in XMLToTavoConverter.iter_entries(content):
+            if cancel_event is not None and cancel_event.is_set():
+                break
             entries.append(entry)
+            stats[entry["metadata"]["type"]] += 1
+            if progress is not None and len(entries) % _STATUS_BATCH == 0:
+                progress(len(entries))
+        return entries, stats
+
+    @staticmethod
+    def iter_entries(content: str) -> Iterator[Dict[str, Any]]:
+        """逐个生成解析出的条目，便于调用方分批处理或中途取消"""
+        for i, match in enumerate(_ENTRY_RE.finditer(content)):
+            fields = dict(_FIELD_RE.findall(match.group(1)))
+            yield XMLToTavoConverter._build_entry(i + 1, fields)
 
-        return entries
+    @staticmethod
+    def _build_entry(entry_id: int, fields: Dict[str, str]) -> Dict[str, Any]:
+        """由字段字典构建单个条目"""
+        return {
+            "id": entry_id,
+            "metadata": {
+                "name": fields.get('comment', '未命名'),
+                "position": fields.get('position', '未知'),
+                "type": fields.get('constant', '未知'),
+                "scan_depth": fields.get('scanDep', ''),
+                "sticky": fields.get('sticky', ''),
+                "cooldown": fields.get('cooldown', ''),
+                "delay": fields.get('delay', '')
+            },
+            "content": {
+                "keywords": fields.get('keyPositif', ''),
+                "negative_keywords": fields.get('keyAdverse', ''),
+                "main_content": fields.get('content', ''),
+                "annotation": fields.get('CN_annotation', ''),
+                "development": fields.get('development', '')
+            }
+        }
 
     @staticmethod
-    def generate_tavo_json(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """生成Tavo格式的JSON"""
+    def generate_tavo_json(entries: List[Dict[str, Any]], stats: Optional[Counter] = None) -> Dict[str, Any]:
+        """生成Tavo格式的JSON；stats为解析时得到的类型统计，未提供时重新统计"""
+        if stats is None:
+            entry_types = XMLToTavoConverter._count_entry_types(entries)
+        else:
+            entry_types = dict(stats)
         return {
             "tavo_format": {
                 "version": "1.0",
@@ -63,7 +106,7 @@ class XMLToTavoConverter:
                 "timestamp": datetime.now().isoformat(),
                 "statistics": {
                     "total_entries": len(entries),
-                    "entry_types": XMLToTavoConverter._count_entry_types(entries)
+                    "entry_types": entry_types
                 },
                 "entries": entries
             }
@@ -72,11 +115,18 @@ class XMLToTavoConverter:
     @staticmethod
     def _count_entry_types(entries: List[Dict[str, Any]]) -> Dict[str, int]:
         """统计条目类型"""
-        type_count = {}
-        for entry in entries:
-            entry_type = entry["metadata"]["type"]
-            type_count[entry_type] = type_count.get(entry_type, 0) + 1
-        return type_count
+        return dict(Counter(entry["metadata"]["type"] for entry in entries))
+
+    @staticmethod
+    def dump_json(data: Dict[str, Any]) -> str:
+        """序列化为缩进2格的JSON文本，优先使用orjson"""
+        if orjson is not None:
+            try:
+                return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode('utf-8')
+            except TypeError:
+                # orjson拒绝孤立代理字符等非法UTF-8内容，交给标准库处理
+                pass
+        return json.dumps(data, ensure_ascii=False, indent=2)
 
 
 class ChangtianWorldBook(BoxLayout):
@@ -86,6 +136,9 @@ class ChangtianWorldBook(BoxLayout):
         self.padding = 15
         self.spacing = 10
         self.converter = XMLToTavoConverter()
+        self._cancel_event = threading.Event()
+        # 输入摘要 -> (JSON输出, 条目数)，按最近使用排序；只在主线程中读写
+        self._result_cache = OrderedDict()
         self.setup_ui()
 
     def setup_ui(self):
@@ -182,36 +235,67 @@ class ChangtianWorldBook(BoxLayout):
             self.show_popup('提示', '请输入XML内容')
             return
 
-        thread = threading.Thread(target=self._convert_in_thread, args=(content,))
+        # 取消仍在进行的上一次转换
+        self._cancel_event.set()
+        self._cancel_event = threading.Event()
+
+        key = hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            self._result_cache.move_to_end(key)
+            self.show_result(*cached)
+            return
+
+        thread = threading.Thread(target=self._convert_in_thread, args=(content, key, self._cancel_event))
         thread.daemon = True
         thread.start()
 
-    def _convert_in_thread(self, content):
+    def _convert_in_thread(self, content, key, cancel_event):
+        def schedule(callback, timeout=0):
+            # 回调在主线程执行时再检查一次：期间若已开始新的转换或已清空，则丢弃本次结果
+            Clock.schedule_once(lambda dt: None if cancel_event.is_set() else callback(), timeout)
+
         try:
-            Clock.schedule_once(lambda dt: self.update_status('解析XML内容...'), 0)
-            entries = self.converter.parse_xml_content(content)
+            schedule(lambda: self.update_status('解析XML内容...'))
+            entries, stats = self.converter.parse_xml_content_with_stats(
+                content,
+                progress=lambda count: schedule(lambda: self.update_status(f'解析中 ({count})...')),
+                cancel_event=cancel_event
+            )
+            if cancel_event.is_set():
+                return
 
             if not entries:
-                Clock.schedule_once(lambda dt: self.show_popup('错误', '未找到有效的XML条目'), 0)
+                schedule(lambda: self.show_popup('错误', '未找到有效的XML条目'))
                 return
 
-            Clock.schedule_once(lambda dt: self.update_status('生成Tavo JSON...'), 0)
-            tavo_json = self.converter.generate_tavo_json(entries)
-            json_output = json.dumps(tavo_json, ensure_ascii=False, indent=2)
+            schedule(lambda: self.update_status('生成Tavo JSON...'))
+            tavo_json = self.converter.generate_tavo_json(entries, stats)
+            json_output = self.converter.dump_json(tavo_json)
+            if cancel_event.is_set():
+                return
 
-            Clock.schedule_once(lambda dt: self.update_status('转换完成!'), 0)
-            Clock.schedule_once(lambda dt: self.show_result(json_output, len(entries)), 0.1)
+            schedule(lambda: self.update_status('转换完成!'))
+            schedule(lambda: self._cache_result(key, json_output, len(entries)))
+            schedule(lambda: self.show_result(json_output, len(entries)), 0.1)
 
         except Exception as e:
             error_msg = f"转换失败: {str(e)}"
-            Clock.schedule_once(lambda dt: self.show_popup('错误', error_msg), 0)
-            Clock.schedule_once(lambda dt: self.update_status('转换出错'), 0)
+            schedule(lambda: self.show_popup('错误', error_msg))
+            schedule(lambda: self.update_status('转换出错'))
 
     def show_result(self, result, entry_count):
         self.result_text.text = result
         self.update_status(f'转换完成! 共{entry_count}个条目')
 
+    def _cache_result(self, key, result, entry_count):
+        self._result_cache[key] = (result, entry_count)
+        self._result_cache.move_to_end(key)
+        while len(self._result_cache) > _RESULT_CACHE_SIZE:
+            self._result_cache.popitem(last=False)
+
     def clear_all(self, instance):
+        self._cancel_event.set()
         self.input_text.text = ''
         self.result_text.text = ''
         self.update_status('已清空')
@@ -222,6 +306,9 @@ class ChangtianWorldBook(BoxLayout):
         self.update_status('示例已加载')
 
     def show_popup(self, title, message):
+        # 弹窗仅在提示/出错时使用，首次用到时再导入，缩短启动时间
+        from kivy.uix.popup import Popup
+
         content = BoxLayout(orientation='vertical', padding=10, spacing=10)
         content.add_widget(Label(text=message))
         btn = Button(text='确定', size_hint_y=None, height=40)